@@ -6,6 +6,16 @@ import time
 from datetime import datetime
 import os
 import platform
+import signal
+from pathlib import Path
+import io
+import hashlib
+import json
+import atexit
+import threading
+import importlib.util
+import httpx
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
 """
 This script uses the Groq API to generate a C++ program based on a prompt, iteratively
@@ -17,6 +27,21 @@ messages, the compiler, and compiler options. The Groq API key is read from 'gro
 Generated code includes comments with the prompt file name, model, generation time, and
 timestamp. Previous attempts are archived with numbered suffixes (e.g., foo1.cpp, foo2.cpp).
 Lines starting with a backtick (`) are commented out as they are invalid in C++.
+Raw API responses whose code compiled are cached in 'response_cache/' keyed by a SHA-256
+hash of the model and prompt, so an identical prompt is answered from disk instead of
+calling Groq again.
+Token usage is reported after each API call, including the number of prompt tokens served
+from Groq's server-side prompt cache. If speculative generation is enabled, a fix is
+requested from Groq while the compiler is still running and is used as the next attempt
+if compilation fails. With num_candidates > 1, each attempt requests several completions
+in parallel at different temperatures, compiles them in parallel, and keeps the first
+that compiles. Responses are streamed, and compilation starts as soon as the ```cpp block
+is closed. On Linux, code is compiled in a RAM-backed directory under /dev/shm and only
+the source file and, on success, the executable are moved to the current directory.
+Compiler errors with a known mechanical fix (a missing #include, standard names used
+without std::, void main) are fixed locally without calling the model. If ccache is
+installed, it caches compilation across attempts and runs (in .ccache_groq_cpp_agent, up
+to 500 MB).
 
 Config file format (config.txt):
     model: <model_name> (e.g., llama-3.3-70b-versatile)
@@ -29,8 +54,14 @@ Config file format (config.txt):
     print_compiler_error_messages: <yes/no> (e.g., yes)
     compiler: <compiler_name> (e.g., g++)
     compiler_options: <options> (e.g., -O2 -Wall) [optional, can be empty]
+    cache_ttl_days: <days> (e.g., 7) [optional, default 7, 0 disables the response cache]
+    speculative_generation: <yes/no> (e.g., no) [optional, default no]
+    num_candidates: <integer> (e.g., 3) [optional, default 1, must be at least 1]
+    use_ccache: <yes/no> (e.g., yes) [optional, default yes]
 
-Dependencies: groq, subprocess, re, shutil, time, datetime, os, platform
+Dependencies: groq, httpx, concurrent.futures, subprocess, re, shutil, time, datetime,
+    os, platform, signal, pathlib, io, hashlib, json, atexit, threading
+Optional: h2 (enables HTTP/2 for the Groq connection), ccache (caches compilation)
 Requires: Specified compiler installed (e.g., g++)
 """
 
@@ -60,168 +91,581 @@ print_code = config["print_code"].lower() == "yes"
 print_compiler_error_messages = config["print_compiler_error_messages"].lower() == "yes"
 compiler = config["compiler"]
 compiler_options = config.get("compiler_options", "").split()  # Handle empty compiler options
+cache_ttl = float(config.get("cache_ttl_days", "7")) * 86400  # Response cache lifetime in seconds
+speculative_generation = config.get("speculative_generation", "no").lower() == "yes"
+num_candidates = int(config.get("num_candidates", "1"))  # Completions requested per attempt
+if num_candidates < 1:
+    raise ValueError(f"num_candidates must be at least 1, got {num_candidates}")
+use_ccache = config.get("use_ccache", "yes").lower() == "yes" and shutil.which("ccache") is not None
+
+# Compiler commands up to the output and source file names, which vary per candidate.
+# ccache only caches compile-only (-c) invocations, so with ccache each candidate is
+# compiled to an object file through ccache and then linked with the plain compiler.
+LINK_CMD_PREFIX = [compiler, *compiler_options]
+COMPILE_CMD_PREFIX = ["ccache", *LINK_CMD_PREFIX] if use_ccache else LINK_CMD_PREFIX
+if use_ccache:
+    os.environ.setdefault("CCACHE_DIR", os.path.abspath(".ccache_groq_cpp_agent"))
+    os.environ.setdefault("CCACHE_MAXSIZE", "500M")  # ccache evicts old entries beyond this size
+
+# Prompts used after a failed attempt; the invariant instructions come first and the
+# error last so Groq's prefix-based prompt cache can reuse as much as possible
+RETRY_PROMPT_TEMPLATE = (
+    "Please fix the following C++ code, which failed to compile, and return it in a ```cpp``` block.\n"
+    "```cpp\n{code}\n```\nError: {error}"
+)
+MAX_ERROR_LINES = 3  # Compiler error lines quoted in a retry prompt
+SPECULATIVE_PROMPT_TEMPLATE = (
+    "Please fix anything in the following C++ code that would prevent it from compiling, "
+    "and return it in a ```cpp``` block.\n```cpp\n{code}\n```\n"
+)
+
+# Response cache location and version of the prompt/post-processing template;
+# bump prompt_version whenever either changes so stale entries are ignored
+cache_dir = "response_cache"
+prompt_version = "v1"
 
 # Determine executable extension based on platform
 is_windows = platform.system() == "Windows"
 executable_ext = ".exe" if is_windows else ""
 executable_path = f".{os.sep}{base_name}{executable_ext}"  # e.g., ".\foo.exe" on Windows, "./foo" on Unix
 
-# Initialize Groq client
-client = groq.Groq(api_key=api_key)
+# Compile in a directory on tmpfs when available so transient sources and executables
+# never reach the disk; it is removed when the script exits. Its name depends only on the
+# user and the current directory, so the paths given to the compiler (and so ccache's
+# hash) are the same in every run.
+work_dir = None
+if os.path.isdir("/dev/shm"):
+    work_dir_key = hashlib.sha256(f"{os.getuid()}\x00{os.getcwd()}".encode()).hexdigest()[:16]
+    work_dir = f"/dev/shm/groq_cpp_agent_{work_dir_key}"
+    os.makedirs(work_dir, exist_ok=True)
+    atexit.register(shutil.rmtree, work_dir, ignore_errors=True)
+    # The source no longer sits in the project directory, so search that directory for
+    # #include "..." headers as the compiler would for a source file there
+    COMPILE_CMD_PREFIX = [*COMPILE_CMD_PREFIX, "-iquote", os.getcwd()]
 
-def generate_code(prompt):
-    # Measure time taken to generate code
-    start_time = time.time()
-    response = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=4096
-    )
-    end_time = time.time()
-    generation_time = end_time - start_time
+# Initialize Groq client on a pooled keep-alive HTTP client so retries reuse the TLS connection
+http_client = httpx.Client(
+    http2=importlib.util.find_spec("h2") is not None,  # HTTP/2 needs the optional h2 package
+    limits=httpx.Limits(max_keepalive_connections=5, max_connections=10, keepalive_expiry=30.0),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+)
+client = groq.Groq(api_key=api_key, http_client=http_client)
 
-    # Get current timestamp
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # Extract raw content
-    content = response.choices[0].message.content
-
-    # Split content into lines
-    lines = content.splitlines()
-
-    # Find the index of the first ```cpp line
-    code_start_idx = -1
-    for i, line in enumerate(lines):
-        if line.strip() == "```cpp":
-            code_start_idx = i
-            break
-
-    # Comment out everything up to and including ```cpp
-    if code_start_idx != -1:
-        for i in range(code_start_idx + 1):
-            if not lines[i].startswith("//"):
-                lines[i] = "//" + lines[i]
-        # Extract code after ```cpp until ``` (if present)
-        code_lines = []
-        for line in lines[code_start_idx + 1:]:
-            if line.strip() == "```":
-                break
-            code_lines.append(line)
-        code = "\n".join(code_lines)
+def prewarm_connection():
+    # Pay DNS, TCP and TLS setup while the rest of the script starts up; any failure
+    # will surface again on the first real request
+    try:
+        client.models.list()
+    except groq.GroqError:
+        pass
+
+threading.Thread(target=prewarm_connection, daemon=True).start()
+
+# Worker threads for parallel candidates and for API calls that overlap with compilation;
+# compiler waits get their own pool so they never queue behind a slow API call
+executor = ThreadPoolExecutor(max_workers=num_candidates + 1)
+compile_executor = ThreadPoolExecutor(max_workers=num_candidates)
+
+def load_cached_response(key):
+    # Return the cache entry for key, or None if it is missing, expired, or from another template version
+    if cache_ttl <= 0:
+        return None
+    try:
+        with open(os.path.join(cache_dir, f"{key}.json"), "r") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (entry.get("promptVersion") != prompt_version or entry.get("modelId") != model
+            or entry.get("expiresAt", 0) <= time.time()):
+        return None
+    return entry
+
+def save_cached_response(key, content, usage, created_at, generation_time):
+    # Write the entry to a temporary file first so readers never see a partial file
+    if cache_ttl <= 0:
+        return
+    entry = {
+        "inputHash": key,
+        "promptVersion": prompt_version,
+        "modelId": model,
+        "createdAt": created_at,
+        "expiresAt": created_at + cache_ttl,
+        "generationTime": generation_time,
+        "content": content,
+        "usage": usage,
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, f"{key}.json")
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(entry, f)
+    os.replace(temp_path, cache_path)
+
+def get_field(obj, name):
+    # Read a field from either an SDK response object or a plain dict
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+def read_usage(chunk):
+    # Return token usage carried by a streamed chunk (Groq sends it with the last one), or None
+    usage = get_field(chunk, "usage") or get_field(get_field(chunk, "x_groq"), "usage")
+    if usage is None:
+        return None
+    # Groq reports prompt-cache hits in x_groq.usage or usage.prompt_tokens_details
+    cached_tokens = get_field(usage, "cached_tokens")
+    if cached_tokens is None:
+        cached_tokens = get_field(get_field(usage, "prompt_tokens_details"), "cached_tokens")
+    return {
+        "prompt_tokens": get_field(usage, "prompt_tokens") or 0,
+        "completion_tokens": get_field(usage, "completion_tokens") or 0,
+        "cached_tokens": cached_tokens or 0,
+    }
+
+def report_usage(usage):
+    # Print token counts and the fraction of the prompt served from Groq's prompt cache
+    if usage["prompt_tokens"] == 0:
+        return
+    cache_hit_rate = usage["cached_tokens"] / usage["prompt_tokens"] * 100
+    print(f"Tokens: prompt={usage['prompt_tokens']}, completion={usage['completion_tokens']}, "
+          f"cached={usage['cached_tokens']} (cache hit rate: {cache_hit_rate:.1f}%)")
+
+# Patterns for the first ```cpp block (ending at a ``` line or the end of the response),
+# for lines starting with a backtick, which are invalid in C++, and for non-blank lines
+CPP_BLOCK_RE = re.compile(r"^[^\S\n]*```cpp[^\S\n]*(?:\n|\Z)(.*?)(?:^[^\S\n]*```[^\S\n]*$|\Z)", re.MULTILINE | re.DOTALL)
+BACKTICK_LINE_RE = re.compile(r"^(?=[^\S\n]*`)", re.MULTILINE)
+NONBLANK_LINE_RE = re.compile(r"^[^\S\n]*\S", re.MULTILINE)
+
+# Start of the comment header written by format_code, its length in lines, and the
+# "file:line:" location at the start of a compiler message
+HEADER_PREFIX = "// Generated from prompt file:"
+HEADER_LINE_COUNT = 4
+ERROR_LOCATION_RE = re.compile(r"^([^\s:]+):(\d+):", re.MULTILINE)
+
+def format_code(content, created_at, generation_time):
+    # Get timestamp of the generation
+    timestamp = datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M:%S")
+
+    # Extract code after the first ```cpp line until ``` (if present)
+    match = CPP_BLOCK_RE.search(content)
+    if match:
+        code = match.group(1)
+        if code.endswith("\n"):
+            code = code[:-1]
     else:
         # If no ```cpp found, comment everything and use it as-is
-        code = "\n".join("//" + line if not line.startswith("//") else line for line in lines)
+        code = re.sub(r"(?m)^(?!//)", "//", content.rstrip("\n")) if content else ""
 
     # Comment out lines starting with a backtick within the code
-    code_lines = code.splitlines()
-    for i in range(len(code_lines)):
-        if code_lines[i].strip().startswith("`"):
-            code_lines[i] = "//" + code_lines[i]
-    code = "\n".join(code_lines)
+    code = BACKTICK_LINE_RE.sub("//", code)
 
     # Calculate lines of code (excluding header)
-    loc = len([line for line in code.splitlines() if line.strip()])
+    loc = sum(1 for _ in NONBLANK_LINE_RE.finditer(code))
 
     # Add comment lines to the top of the code
     header = (
-        f"// Generated from prompt file: {prompt_file}\n"
+        f"{HEADER_PREFIX} {prompt_file}\n"
         f"// Model used: {model}\n"
         f"// Time generated: {timestamp}\n"
         f"// Generation time: {generation_time:.3f} seconds\n"
     )
-    return header + code, generation_time, loc
+    return header + code, loc
 
-def test_code(code, filename=source_file, attempt=1):
-    # If not the first attempt, save a copy with suffix (e.g., foo1.cpp, foo2.cpp)
-    if attempt > 1:
-        archive_filename = f"{base_name}{attempt-1}.cpp"
-        shutil.copyfile(filename, archive_filename)
-    
+def generate_code(prompt, temperature=None, seed=None, on_code=None, cancel_event=None):
+    # Sampling parameters are part of the cache key so parallel candidates stay distinct
+    sampling = {}
+    if temperature is not None:
+        sampling["temperature"] = temperature
+    if seed is not None:
+        sampling["seed"] = seed
+    key_text = model + "\x00" + prompt
+    if sampling:
+        key_text += "\x00" + json.dumps(sampling, sort_keys=True)
+
+    # Measure time taken to generate code
+    start_time = time.time()
+    key = hashlib.sha256(key_text.encode()).hexdigest()
+    entry = load_cached_response(key)
+    if entry is not None:
+        # Reuse the cached response; the header keeps the original timestamp and generation time
+        code, loc = format_code(entry["content"], entry["createdAt"], entry["generationTime"])
+        generation_time = time.time() - start_time
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}  # No tokens were sent
+        print(f"Using cached response from {cache_dir}{os.sep}{key}.json")
+        return code, generation_time, loc, usage, None
+
+    # Stream the response so the code can be used as soon as its ```cpp block is closed
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=4096,
+        stream=True,
+        **sampling
+    )
+    # Accumulate the response in one buffer and only scan for fences when a line is complete
+    content_buffer = io.StringIO()
+    line_buffer = ""
+    in_cpp_fence = False
+    code = None
+    usage = None
+    for chunk in stream:
+        if cancel_event is not None and cancel_event.is_set():
+            # The response is no longer wanted; closing the stream ends the request
+            stream.close()
+            return None
+        usage = read_usage(chunk) or usage
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        delta = chunk.choices[0].delta.content
+        content_buffer.write(delta)
+        if code is not None:
+            continue  # Keep draining the stream so the connection can be reused
+        line_buffer += delta
+        if "\n" not in delta:
+            continue
+        *lines, line_buffer = line_buffer.split("\n")
+        for line in lines:
+            if not in_cpp_fence:
+                in_cpp_fence = line.strip() == "```cpp"
+            elif line.strip() == "```":
+                # The code block is complete; anything after it is discarded
+                created_at = time.time()
+                header_gen_time = created_at - start_time
+                code, loc = format_code(content_buffer.getvalue(), created_at, header_gen_time)
+                if on_code is not None:
+                    on_code(code)
+                break
+    end_time = time.time()
+    generation_time = end_time - start_time
+    content = content_buffer.getvalue()
+    if code is None:
+        # No closed ```cpp block, so the whole response is needed
+        created_at = end_time
+        header_gen_time = generation_time
+        code, loc = format_code(content, created_at, header_gen_time)
+
+    # Return the raw content for the cache; it is only stored once the code has compiled,
+    # so a failed sample is never replayed by a later run
+    if usage is None:
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    cache_entry = (key, content, usage, created_at, header_gen_time)
+    return code, generation_time, loc, usage, cache_entry
+
+def archive_source(attempt):
+    # Rename the given attempt to a name with suffix (e.g., foo1.cpp, foo2.cpp); the source
+    # file is rewritten by the next attempt, so no copy of its contents is needed
+    if os.path.exists(source_file):
+        os.replace(source_file, f"{base_name}{attempt}.cpp")
+
+def launch_compiler(command):
+    # Run a compiler command without waiting for it to finish. Error messages are always
+    # captured in memory since the retry prompt needs them, and each compiler gets its own
+    # process group so it can be killed with its children.
+    return subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True
+    )
+
+def start_compile(code, filename=source_file, output=base_name):
     # Write the new code to the source file
-    with open(filename, "w") as f:
-        f.write(code)
+    Path(filename).write_text(code)
     
-    # Compile with specified compiler and options
-    compile_command = [compiler] + compiler_options + ["-o", base_name, filename]
-    if print_compiler_error_messages:
-        result = subprocess.run(
-            compile_command,
-            capture_output=True,
-            text=True
-        )
-        error = result.stderr
+    # Launch the specified compiler with its options
+    if use_ccache:
+        compile_command = COMPILE_CMD_PREFIX + ["-c", "-o", f"{output}.o", filename]
     else:
-        with open("temp_compiler_error.txt", "w") as error_file:
-            result = subprocess.run(
-                compile_command,
-                stderr=error_file,
-                text=True
-            )
-        with open("temp_compiler_error.txt", "r") as error_file:
-            error = error_file.read()
-        os.remove("temp_compiler_error.txt")
-    
-    return result.returncode == 0, error
+        compile_command = COMPILE_CMD_PREFIX + ["-o", output, filename]
+    return launch_compiler(compile_command), output
+
+def finish_compile(process, output, cancel_event=None):
+    # Wait for a compiler launched by start_compile and collect its error messages
+    _, error = process.communicate()
+    success = process.returncode == 0
+    if success and use_ccache:
+        # Link the object file produced by the cached compile step; the linker is killed
+        # if another candidate wins in the meantime
+        link_process = launch_compiler(LINK_CMD_PREFIX + ["-o", output, f"{output}.o"])
+        while True:
+            try:
+                _, link_error = link_process.communicate(timeout=0.05)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_event is not None and cancel_event.is_set():
+                    kill_compile(link_process)
+        error += link_error
+        success = link_process.returncode == 0
+    if use_ccache:
+        # The object file is only an intermediate; ccache keeps its own copy
+        try:
+            os.remove(f"{output}.o")
+        except OSError:
+            pass
+    if work_dir is not None:
+        error = error.replace(work_dir + os.sep, "")  # Keep messages (and prompts) independent of the work directory
+    return success, error
+
+def kill_compile(process):
+    # Stop a compiler that is no longer needed, including the cc1plus/as/ld children g++ spawns
+    if process.poll() is not None:
+        return
+    if is_windows:
+        process.kill()
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # Finished in the meantime
+
+def candidate_paths(i):
+    # Source and output file names used to compile candidate i
+    if num_candidates == 1:
+        filename, output = source_file, base_name
+    else:
+        filename, output = f"{base_name}_cand{i}.cpp", f"{base_name}_cand{i}"
+    if work_dir is not None:
+        filename = os.path.join(work_dir, os.path.basename(filename))
+        output = os.path.join(work_dir, os.path.basename(output))
+    return filename, output
+
+def generate_candidates(prompt, count=num_candidates):
+    # Request count completions in parallel, spreading temperatures so the candidates differ,
+    # and start compiling each one as soon as its code block is complete
+    start_time = time.time()
+    jobs = [None] * count
+    def compile_early(i, code):
+        jobs[i] = start_compile(code, *candidate_paths(i))
+    def sampling(i):
+        # Sampling depends only on the configured number of candidates and the index, so a
+        # candidate is sampled (and cached) the same way whether or not speculation ran
+        return {} if num_candidates == 1 else {"temperature": min(0.2 + 0.3 * i, 2.0), "seed": i}
+    if count == 1:
+        candidates = [generate_code(prompt, on_code=lambda code: compile_early(0, code), **sampling(0))]
+    else:
+        futures = [executor.submit(generate_code, prompt, on_code=lambda code, i=i: compile_early(i, code),
+                                   **sampling(i))
+                   for i in range(count)]
+        candidates = [future.result() for future in futures]
+    for candidate in candidates:
+        report_usage(candidate[3])
+    return candidates, jobs, time.time() - start_time
+
+def promote_candidate(i, success):
+    # Move candidate i to the configured source file (and executable, if it compiled)
+    filename, output = candidate_paths(i)
+    if filename != source_file:
+        shutil.move(filename, source_file)
+        if success:
+            shutil.move(f"{output}{executable_ext}", f"{base_name}{executable_ext}")
+
+def remove_candidates(count):
+    # Delete the files left by candidates that were not promoted, which would otherwise
+    # accumulate in the current directory when there is no work directory
+    for i in range(count):
+        filename, output = candidate_paths(i)
+        if filename == source_file:
+            continue
+        for path in (filename, f"{output}{executable_ext}", f"{output}.o"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Never created, already promoted, or still locked by a killed compiler
+
+def test_candidates(candidates, jobs):
+    # Launch the compilers not already started during generation back-to-back
+    jobs = [job or start_compile(candidate[0], *candidate_paths(i))
+            for i, (candidate, job) in enumerate(zip(candidates, jobs))]
+
+    # Wait for them in parallel and return the index of the first that compiles
+    # (or 0 if none does) together with its result
+    cancel_event = threading.Event()
+    futures = {compile_executor.submit(finish_compile, *job, cancel_event): i for i, job in enumerate(jobs)}
+    errors = {}
+    for future in as_completed(futures):
+        i = futures[future]
+        success, error = future.result()
+        if success:
+            # Kill the losing compilers and linkers rather than waiting for them
+            cancel_event.set()
+            for process, _ in jobs:
+                kill_compile(process)
+            promote_candidate(i, True)
+            wait(futures)  # The killed losers stop promptly; their files can then be removed
+            remove_candidates(len(jobs))
+            return i, True, error
+        errors[i] = error
+    # Keep the first candidate as this attempt's code when none compiles
+    promote_candidate(0, False)
+    remove_candidates(len(jobs))
+    return 0, False, errors[0]
+
+def strip_header(code):
+    # Drop the comment header added by format_code; its timestamp and timing change on every
+    # call, so leaving it in a prompt would defeat Groq's prefix cache and the response cache
+    if not code.startswith(HEADER_PREFIX):
+        return code
+    lines = code.split("\n", HEADER_LINE_COUNT)
+    return lines[HEADER_LINE_COUNT] if len(lines) > HEADER_LINE_COUNT else ""
+
+def shift_line_number(match):
+    # Renumber a "file:line:" location to match the code with its header stripped
+    line_number = int(match.group(2))
+    if line_number <= HEADER_LINE_COUNT:
+        return match.group(0)
+    return f"{match.group(1)}:{line_number - HEADER_LINE_COUNT}:"
+
+def summarize_error(error):
+    # Keep only the first few error lines; g++ often reports one root cause many times
+    # (e.g., once per template instantiation) and every extra line adds prompt tokens.
+    # Line numbers are shifted to match the code sent without its header.
+    error_lines = [line for line in error.splitlines() if "error:" in line or "undefined reference" in line]
+    summary = "\n".join(error_lines[:MAX_ERROR_LINES]) if error_lines else error
+    return ERROR_LOCATION_RE.sub(shift_line_number, summary)
+
+def add_lines_after_header(code, new_lines):
+    # Insert lines after the leading comment header written by format_code
+    lines = code.split("\n")
+    i = 0
+    while i < len(lines) and lines[i].startswith("//"):
+        i += 1
+    return "\n".join(lines[:i] + new_lines + lines[i:])
+
+def add_includes(code, headers):
+    # Add #include lines for the headers that are not already included
+    new_lines = [f"#include <{header}>" for header in headers if f"#include <{header}>" not in code]
+    return add_lines_after_header(code, new_lines) if new_lines else code
+
+def add_using_std(code):
+    # Make the common standard library names visible without a std:: prefix
+    code = add_includes(code, ["iostream", "string", "vector", "map"])
+    if "using namespace std;" in code:
+        return code
+    lines = code.split("\n")
+    i = max((j for j, line in enumerate(lines) if line.startswith("#include")), default=-1)
+    return "\n".join(lines[:i + 1] + ["using namespace std;"] + lines[i + 1:])
+
+# Compiler errors with a mechanical fix, as (pattern, fix(match, code)) pairs; g++ quotes
+# names with ASCII quotes in the C locale and with typographic quotes otherwise
+LOCAL_FIXERS = [
+    (re.compile(r"did you forget to [\u2018']#include <([\w./]+)>[\u2019']"),
+     lambda match, code: add_includes(code, [match.group(1)])),
+    (re.compile(r"error: [\u2018'](cout|cin|cerr|endl|string|vector|map)[\u2019'] was not declared"),
+     lambda match, code: add_using_std(code)),
+    (re.compile(r"error: [\u2018']::main[\u2019'] must return [\u2018']int[\u2019']"),
+     lambda match, code: re.sub(r"\bvoid(\s+main\s*\()", r"int\1", code, count=1)),
+]
+
+def apply_local_fixes(code, error):
+    # Apply every matching local fix; return the fixed code, or None if nothing changed
+    fixed_code = code
+    for pattern, fix in LOCAL_FIXERS:
+        for match in pattern.finditer(error):
+            fixed_code = fix(match, fixed_code)
+    return fixed_code if fixed_code != code else None
 
 # Read initial prompt from file specified in config
 with open(prompt_file, "r") as f:
     prompt = f.read() + "Only output C++ code. Do not give commentary.\n"
     print("prompt:\n" + prompt)
 print("model: " + model + "\n")
-code, initial_gen_time, initial_loc = generate_code(prompt)
-total_gen_time = initial_gen_time
-attempts = 1
+candidates, jobs, gen_time = generate_candidates(prompt)
+total_gen_time = gen_time
+error = ""
+speculated = False  # Whether the current code came from a speculative fix
 
 # Iterate until compilation succeeds or limits are exceeded
-while True:
-    success, error = test_code(code, attempt=attempts)
+for attempt in range(1, max(max_attempts, 1) + 1):
+    # Optionally request a fix while the compiler runs; it is made without this attempt's
+    # error message, so it only sees the error from the previous attempt (if any). Speculation
+    # alternates with error-driven fixes so the compiler errors always reach the model.
+    speculative_future = None
+    speculative_cancel = threading.Event()
+    if speculative_generation and not speculated and attempt < max_attempts and total_gen_time < max_time:
+        speculative_prompt = SPECULATIVE_PROMPT_TEMPLATE.format_map({"code": strip_header(candidates[0][0])})
+        if error:
+            speculative_prompt += f"A previous version failed with error: {summarize_error(error)}"
+        speculative_start = time.time()
+        speculative_future = executor.submit(generate_code, speculative_prompt, cancel_event=speculative_cancel)
+
+    index, success, error = test_candidates(candidates, jobs)
+    code, _, loc, _, cache_entry = candidates[index]
+    attempts_text = f"{attempt} {'attempt' if attempt == 1 else 'attempts'}"
     if success:
-        print(f"Code compiled successfully after {attempts} {'attempt' if attempts == 1 else 'attempts'} (generation time: {initial_gen_time if attempts == 1 else gen_time:.3f} seconds, LOC={initial_loc if attempts == 1 else loc})!")
-        if print_code:
-            print("Final version:\n\n", code)
-        if run_executable:
-            if os.path.exists(executable_path):
-                print(f"Running executable: {executable_path}")
-                run_result = subprocess.run(executable_path, capture_output=True, text=True, input="5\n")
-                if run_result.returncode == 0:
-                    print("\nOutput:\n", run_result.stdout)
-                else:
-                    print(f"\nExecution failed with error: {run_result.stderr}")
-            else:
-                print(f"\nExecutable not found at {executable_path}. Ensure compilation succeeded.")
-        else:
-            print("\nSkipping execution as per config (run_executable: no)")
-        print(f"\nTotal generation time: {total_gen_time:.3f} seconds across {attempts} {'attempt' if attempts == 1 else 'attempts'}")
+        # Discard the speculative fix; a request already in flight stops at its next chunk
+        if speculative_future is not None:
+            speculative_future.cancel()
+            speculative_cancel.set()
+        if cache_entry is not None:
+            save_cached_response(*cache_entry)
+        print(f"Code compiled successfully after {attempts_text} (generation time: {gen_time:.3f} seconds, LOC={loc})!")
         break
+    if print_compiler_error_messages:
+        print(f"Attempt {attempt} failed with error (generation time: {gen_time:.3f} seconds, LOC={loc}): {error}")
     else:
-        if print_compiler_error_messages:
-            print(f"Attempt {attempts} failed with error (generation time: {initial_gen_time if attempts == 1 else gen_time:.3f} seconds, LOC={initial_loc if attempts == 1 else loc}): {error}")
+        print(f"Attempt {attempt} failed (error details suppressed, generation time: {gen_time:.3f} seconds, LOC={loc})")
+    if attempt >= max_attempts:
+        print(f"Max attempts ({max_attempts}) reached.")
+        break
+
+    # Fix known trivial errors locally instead of asking the model
+    fixed_code = apply_local_fixes(code, error)
+
+    # Check if we've exceeded max_time before generating more code
+    if fixed_code is None and total_gen_time >= max_time:
+        print(f"Max generation time ({max_time} seconds) exceeded after {attempts_text}.")
+        break
+
+    # Archive this attempt before new code (which may be compiled while streaming) replaces it
+    archive_source(attempt)
+    if fixed_code is not None:
+        if speculative_future is not None:
+            speculative_future.cancel()
+            speculative_cancel.set()
+            speculative_future = None
+        print("Applying local fix without calling the model")
+        fixed_loc = loc + fixed_code.count("\n") - code.count("\n")  # Fixes only add non-blank lines
+        no_usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        candidates, jobs, gen_time = [(fixed_code, 0.0, fixed_loc, no_usage, None)], [None], 0.0
+    else:
+        prompt = RETRY_PROMPT_TEMPLATE.format_map({"code": strip_header(code), "error": summarize_error(error)})
+        if speculative_future is not None:
+            # Request the error-driven fixes while the speculative one may still be streaming,
+            # then use the speculative fix as the last candidate
+            candidates, jobs, _ = generate_candidates(prompt, num_candidates - 1)
+            speculative = speculative_future.result()
+            print("Using speculative fix generated during compilation")
+            report_usage(speculative[3])
+            candidates.append(speculative)
+            jobs.append(None)
+            gen_time = time.time() - speculative_start  # Wall time since the speculative request began
         else:
-            print(f"Attempt {attempts} failed (error details suppressed, generation time: {initial_gen_time if attempts == 1 else gen_time:.3f} seconds, LOC={initial_loc if attempts == 1 else loc})")
-        
-        # Check if we've exceeded max_time before generating more code
-        if total_gen_time >= max_time:
-            print(f"Max generation time ({max_time} seconds) exceeded after {attempts} attempts.")
-            if print_code:
-                print("Last code:\n", code)
-            print(f"\nTotal generation time: {total_gen_time:.3f} seconds")
-            break
-        
-        prompt = (
-            f"The following C++ code failed to compile: \n```cpp\n{code}\n```\n"
-            f"Error: {error}\nPlease fix the code and return it in a ```cpp``` block."
-        )
-        code, gen_time, loc = generate_code(prompt)
-        total_gen_time += gen_time
-        attempts += 1
-        
-        if attempts > max_attempts:
-            print(f"Max attempts ({max_attempts}) reached.")
-            if print_code:
-                print("Last code:\n", code)
-            print(f"Total generation time: {total_gen_time:.3f} seconds")
-            break
+            candidates, jobs, gen_time = generate_candidates(prompt)
+    speculated = speculative_future is not None
+    total_gen_time += gen_time
+
+# Drop queued API calls and compiler waits instead of letting them delay the exit
+executor.shutdown(wait=False, cancel_futures=True)
+compile_executor.shutdown(wait=False, cancel_futures=True)
+
+if success:
+    if print_code:
+        print("Final version:\n\n", code)
+    if run_executable:
+        if os.path.exists(executable_path):
+            print(f"Running executable: {executable_path}")
+            run_result = subprocess.run(executable_path, capture_output=True, text=True, input="5\n")
+            if run_result.returncode == 0:
+                print("\nOutput:\n", run_result.stdout)
+            else:
+                print(f"\nExecution failed with error: {run_result.stderr}")
+        else:
+            print(f"\nExecutable not found at {executable_path}. Ensure compilation succeeded.")
+    else:
+        print("\nSkipping execution as per config (run_executable: no)")
+elif print_code:
+    print("Last code:\n", code)
+print(f"\nTotal generation time: {total_gen_time:.3f} seconds across {attempts_text}")
 
 # Print the compilation command
-compile_command = [compiler] + compiler_options + ["-o", base_name, source_file]
+compile_command = LINK_CMD_PREFIX + ["-o", base_name, source_file]
 print(f"\nCompilation command: {' '.join(compile_command)}")